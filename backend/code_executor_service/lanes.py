@@ -0,0 +1,76 @@
+import threading
+import time
+from collections import deque
+
+import metrics
+
+# Очереди полос. Медленная полоса сохраняет старое имя submission_queue,
+# чтобы посылки, отправленные до перехода на полосы, тоже были проверены.
+LANE_QUEUES = {
+    "fast": "submission_fast_queue",
+    "slow": "submission_queue",
+}
+
+
+def parse_lane_weights(value: str) -> dict:
+    """Разбирает строку вида "fast:4,slow:1"."""
+    weights = {}
+    for part in value.split(","):
+        lane, _, weight = part.partition(":")
+        weights[lane.strip()] = int(weight)
+    return weights
+
+
+class LaneScheduler:
+    """Планировщик посылок по полосам со взвешенным round-robin.
+
+    Поток соединения с RabbitMQ кладет посылки через put(), рабочие потоки
+    забирают их через get(). Полоса с большим весом обслуживается чаще, а
+    `max_running` ограничивает, сколько воркеров может одновременно занять
+    полоса - так тяжелые юнит-тесты не забирают все воркеры у быстрых проверок.
+    """
+
+    def __init__(self, weights: dict, max_running: dict = None):
+        self.weights = weights
+        self.max_running = max_running or {}
+        self._pending = {lane: deque() for lane in weights}
+        self._running = {lane: 0 for lane in weights}
+        self._current = {lane: 0 for lane in weights}
+        self._cond = threading.Condition()
+
+    def put(self, lane: str, item):
+        with self._cond:
+            self._pending[lane].append((time.monotonic(), item))
+            metrics.set_gauge(f"lane.{lane}.local_depth", len(self._pending[lane]))
+            self._cond.notify()
+
+    def _eligible(self) -> list:
+        return [
+            lane for lane, pending in self._pending.items()
+            if pending and self._running[lane] < self.max_running.get(lane, float("inf"))
+        ]
+
+    def get(self):
+        """Блокируется, пока не появится посылка, которую можно взять. Возвращает (lane, item)."""
+        with self._cond:
+            while not self._eligible():
+                self._cond.wait()
+            eligible = self._eligible()
+            # Плавный взвешенный round-robin (как в nginx)
+            total = 0
+            for lane in eligible:
+                self._current[lane] += self.weights[lane]
+                total += self.weights[lane]
+            lane = max(eligible, key=lambda name: self._current[name])
+            self._current[lane] -= total
+
+            queued_at, item = self._pending[lane].popleft()
+            self._running[lane] += 1
+            metrics.set_gauge(f"lane.{lane}.local_depth", len(self._pending[lane]))
+        metrics.observe(f"lane.{lane}.wait_seconds", time.monotonic() - queued_at)
+        return lane, item
+
+    def done(self, lane: str):
+        with self._cond:
+            self._running[lane] -= 1
+            self._cond.notify_all()
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+import metrics
+
+
+class SpecUnavailable(Exception):
+    """Спецификацию не удалось получить от core_service (сервис недоступен или отвечает ошибкой).
+
+    Посылка в этом не виновата: ее нужно вернуть в очередь, а не отвечать ошибкой.
+    """
+
+
+def parse_test_code(test_code: str):
+    """Парсит 'магические' комментарии из кода теста."""
+    test_type = "unit"  # По умолчанию - юнит-тесты
+    expected_output = None
+    lines = test_code.strip().split('\n')
+    for line in lines:
+        if line.strip().startswith("# test_type:"):
+            test_type = line.split(":", 1)[1].strip()
+        if line.strip().startswith("# expected_output:"):
+            expected_output = line.split(":", 1)[1].strip()
+    return test_type, expected_output
+
+
+def build_test_spec(test_code: str) -> dict:
+    """Разбирает код теста один раз: тип теста, ожидаемый вывод и готовый тестовый модуль."""
+    test_type, expected_output = parse_test_code(test_code)
+    # Pytest требует, чтобы тестовый файл импортировал решение,
+    # поэтому мы добавляем import solution в начало, если его нет.
+    test_module = test_code
+    if "import solution" not in test_code:
+        test_module = "import solution\n" + test_code
+    return {
+        "test_type": test_type,
+        "expected_output": expected_output,
+        "test_code": test_code,
+        "test_module": test_module,
+    }
+
+
+class SpecCache:
+    """LRU разобранных спецификаций тестов по (lesson_id, spec_version).
+
+    Версия - хэш кода тестов, поэтому запись никогда не устаревает: после
+    изменения тестов урока в сообщениях просто приходит новая версия.
+    """
+
+    def __init__(self, core_service_url: str, max_entries: int = 1000, timeout: float = 5,
+                 retries: int = 3, backoff: float = 0.5):
+        self.core_service_url = core_service_url
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, lesson_id: int, spec_version: str):
+        """Спецификация тестов урока или None, если тестов у урока нет.
+
+        Бросает SpecUnavailable, если core_service не ответил и после повторов.
+        """
+        key = (lesson_id, spec_version)
+        with self._lock:
+            found = key in self._entries
+            if found:
+                spec = self._entries[key]
+                self._entries.move_to_end(key)
+        if found:
+            metrics.inc("test_spec_cache.hits")
+            return spec
+
+        metrics.inc("test_spec_cache.misses")
+        spec, fetched_version = self._fetch(lesson_id)
+        keys = [(lesson_id, fetched_version)]
+        if fetched_version != spec_version:
+            # Тесты урока поменялись между отправкой и проверкой - проверяем по актуальным.
+            # Запоминаем и под запрошенной версией, чтобы остальные старые сообщения не ходили в core_service
+            if fetched_version is not None:
+                print(f"Test spec for lesson {lesson_id}: requested {spec_version}, got {fetched_version}", flush=True)
+            keys.append(key)
+        with self._lock:
+            for cache_key in keys:
+                self._entries[cache_key] = spec
+                self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return spec
+
+    def _fetch(self, lesson_id: int):
+        """Запрашивает спецификацию с повторами и растущей паузой между ними."""
+        for attempt in range(self.retries + 1):
+            try:
+                res = requests.get(
+                    f"{self.core_service_url}/internal/lessons/{lesson_id}/test-spec", timeout=self.timeout
+                )
+                if res.status_code == 404:
+                    # Урока или тестов у него нет - это окончательный ответ
+                    return None, None
+                res.raise_for_status()
+                data = res.json()
+                return build_test_spec(data["test_code"]), data["spec_version"]
+            except (requests.RequestException, ValueError) as e:
+                metrics.inc("test_spec_cache.fetch_errors")
+                if attempt == self.retries:
+                    raise SpecUnavailable(f"test spec for lesson {lesson_id}: {e}") from e
+                time.sleep(self.backoff * 2 ** attempt)
@@ -0,0 +1,64 @@
+import threading
+import time
+from collections import deque
+
+# Как часто (в секундах) печатать накопленные метрики в лог
+_LOG_INTERVAL = 60
+# Сколько последних наблюдений хранить для расчета перцентилей
+_RESERVOIR_SIZE = 1000
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_observations = {}
+_last_log = time.monotonic()
+
+
+def inc(name: str, value: int = 1):
+    """Увеличивает счетчик метрики."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value):
+    """Запоминает текущее значение метрики (например, глубину очереди)."""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float):
+    """Добавляет наблюдение (например, задержку) для расчета перцентилей."""
+    with _lock:
+        if name not in _observations:
+            _observations[name] = deque(maxlen=_RESERVOIR_SIZE)
+        _observations[name].append(value)
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def snapshot() -> dict:
+    """Возвращает копию всех счетчиков, значений и перцентилей наблюдений."""
+    with _lock:
+        result = dict(_counters)
+        result.update(_gauges)
+        for name, values in _observations.items():
+            result[f"{name}.p50"] = round(percentile(values, 0.50), 4)
+            result[f"{name}.p95"] = round(percentile(values, 0.95), 4)
+    return result
+
+
+def maybe_log():
+    """Раз в _LOG_INTERVAL секунд печатает метрики одной строкой."""
+    global _last_log
+    with _lock:
+        now = time.monotonic()
+        if now - _last_log < _LOG_INTERVAL:
+            return
+        _last_log = now
+    line = " ".join(f"{name}={value}" for name, value in sorted(snapshot().items()))
+    print(f"[metrics] {line}", flush=True)
@@ -0,0 +1,181 @@
+import codecs
+import os
+import resource
+import selectors
+import signal
+import time
+
+# Сколько секунд после расхождения вывода даем процессу завершиться самому: программа,
+# которая сразу падает, должна показать свою ошибку, а не "Тест не пройден"
+DIVERGED_GRACE = float(os.getenv("DIVERGED_GRACE", "0.5"))
+
+
+class OutputWatcher:
+    """Потоково принимает stdout/stderr дочернего процесса.
+
+    Если задан `expected_output`, stdout сравнивается с ним по мере поступления
+    (с той же семантикой, что `stdout.strip() == expected_output`), и при первом
+    расхождении выставляется `stop_reason = "diverged"` (вывод читается дальше,
+    пока процесс не остановят). Если суммарный вывод
+    превысил `max_bytes`, выставляется `stop_reason = "output_limit"`.
+    Хранится не больше `max_bytes` вывода, поэтому память на запуск ограничена.
+    """
+
+    def __init__(self, expected_output: str = None, max_bytes: int = 65536):
+        self.expected_output = expected_output
+        self.max_bytes = max_bytes
+        self.stop_reason = None
+        self._total_bytes = 0
+        self._decoders = {
+            "stdout": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+            "stderr": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+        }
+        self._chunks = {"stdout": [], "stderr": []}
+        self._started = False  # Встретился ли в stdout непробельный символ
+        self._matched = 0  # Сколько символов expected_output уже совпало
+
+    def feed(self, stream: str, data: bytes) -> bool:
+        """Принимает очередной кусок вывода. Возвращает False, если процесс пора остановить."""
+        allowed = self.max_bytes - self._total_bytes
+        self._total_bytes += len(data)
+        if allowed > 0:
+            text = self._decoders[stream].decode(data[:allowed])
+            self._chunks[stream].append(text)
+            if stream == "stdout" and self.expected_output is not None and self.stop_reason is None:
+                self._compare(text)
+        if self._total_bytes > self.max_bytes and self.stop_reason is None:
+            self.stop_reason = "output_limit"
+        return self.stop_reason != "output_limit"
+
+    def _compare(self, text: str):
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return
+            self._started = True
+        expected = self.expected_output
+        n = min(len(text), len(expected) - self._matched)
+        if text[:n] != expected[self._matched:self._matched + n]:
+            self.stop_reason = "diverged"
+            return
+        self._matched += n
+        rest = text[n:]
+        # После полного совпадения допустимы только пробельные символы (их срежет strip)
+        if rest and not rest.isspace():
+            self.stop_reason = "diverged"
+
+    @property
+    def total_bytes(self) -> int:
+        """Сколько байт вывода процесс успел отдать (включая не сохраненные сверх лимита)."""
+        return self._total_bytes
+
+    @property
+    def stdout(self) -> str:
+        return "".join(self._chunks["stdout"])
+
+    @property
+    def stderr(self) -> str:
+        return "".join(self._chunks["stderr"])
+
+
+def collect_output(streams: dict, deadline: float, watcher: OutputWatcher) -> dict:
+    """Читает дескрипторы до EOF, дедлайна или сигнала watcher'а остановить процесс.
+
+    После расхождения вывода чтение продолжается еще DIVERGED_GRACE секунд.
+    `streams` - словарь {fd: имя}, где "stdout"/"stderr" отдаются watcher'у,
+    а остальные потоки собираются целиком. Возвращает {"timed_out": bool,
+    "cut": bool - чтение остановлено до EOF, "stop_at": до какого момента ждать процесс, имя: bytes}.
+    """
+    extra = {name: [] for name in streams.values() if name not in ("stdout", "stderr")}
+    timed_out = False
+    stop_at = deadline
+    with selectors.DefaultSelector() as sel:
+        for fd in streams:
+            sel.register(fd, selectors.EVENT_READ)
+        while sel.get_map() and watcher.stop_reason != "output_limit":
+            if watcher.stop_reason == "diverged" and stop_at == deadline:
+                stop_at = min(deadline, time.monotonic() + DIVERGED_GRACE)
+            remaining = stop_at - time.monotonic()
+            if remaining <= 0:
+                timed_out = stop_at == deadline
+                break
+            for key, _ in sel.select(remaining):
+                data = os.read(key.fd, 65536)
+                name = streams[key.fd]
+                if not data:
+                    sel.unregister(key.fd)
+                elif name in extra:
+                    extra[name].append(data)
+                elif not watcher.feed(name, data):
+                    break
+        cut = bool(sel.get_map()) and not timed_out
+    collected = {name: b"".join(chunks) for name, chunks in extra.items()}
+    collected["timed_out"] = timed_out
+    collected["cut"] = cut
+    collected["stop_at"] = stop_at
+    return collected
+
+
+def watch_child(pid: int, streams: dict, deadline: float, watcher: OutputWatcher):
+    """Собирает вывод дочернего процесса и забирает его (см. collect_output и reap_child).
+
+    Возвращает (collected, status, rusage). В collected["stop_reason"] - почему процесс
+    остановили мы ("diverged", "output_limit") или None, если он завершился сам.
+    """
+    collected = collect_output(streams, deadline, watcher)
+    # Потоки могут закрыться раньше, чем процесс завершится (например, закрыл stdout сам)
+    status, rusage, reap_timed_out = reap_child(
+        pid, collected["stop_at"], kill=collected["timed_out"] or collected["cut"]
+    )
+    cut = collected["cut"]
+    if reap_timed_out:
+        if collected["stop_at"] < deadline:
+            cut = True  # Не завершился за время после расхождения
+        else:
+            collected["timed_out"] = True
+    collected["stop_reason"] = watcher.stop_reason if cut else None
+    return collected, status, rusage
+
+
+def set_limits(cpu_seconds: int, memory_bytes: int = 0, pid: int = 0):
+    """Ставит процессу (pid=0 - текущему) лимиты процессорного времени и памяти."""
+    resource.prlimit(pid, resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds))
+    if memory_bytes:
+        # RLIMIT_DATA, а не RLIMIT_AS: виртуальные резервы потоков и mmap библиотек
+        # не должны ронять обычный код, ограничиваем именно выделяемую память
+        resource.prlimit(pid, resource.RLIMIT_DATA, (memory_bytes, memory_bytes))
+
+
+def reap_child(pid: int, deadline: float, kill: bool = False):
+    """Дожидается завершения дочернего процесса до дедлайна и забирает его rusage.
+
+    Если `kill=True` или дедлайн прошел, убивает всю группу процессов.
+    Возвращает (status, rusage, timed_out).
+    """
+    timed_out = False
+    while not kill:
+        finished, status, rusage = os.wait4(pid, os.WNOHANG)
+        if finished:
+            return status, rusage, False
+        if time.monotonic() >= deadline:
+            timed_out = True
+            break
+        time.sleep(0.005)
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    _, status, rusage = os.wait4(pid, 0)
+    return status, rusage, timed_out
+
+
+def describe_resources(rusage, wall_time: float, watcher: OutputWatcher) -> dict:
+    """Сколько стоил запуск: время, процессор, пиковая память и объем вывода."""
+    return {
+        "wall_time": round(wall_time, 4),
+        "cpu_time": round(rusage.ru_utime + rusage.ru_stime, 4),
+        # В Linux ru_maxrss уже в килобайтах. Это оценка сверху: процесс наследует
+        # пиковую память родителя на момент fork (воркера пула или самого исполнителя)
+        "peak_rss_kb": rusage.ru_maxrss,
+        "output_bytes": watcher.total_bytes,
+    }
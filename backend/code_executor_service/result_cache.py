@@ -0,0 +1,88 @@
+import ast
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Если код импортирует эти модули, его результат может меняться от запуска к запуску
+NONDETERMINISTIC_MODULES = {"random", "time", "datetime", "uuid", "secrets", "os", "threading", "multiprocessing"}
+
+
+def normalize_code(code: str) -> str:
+    """Приводит код к каноничному виду: переводы строк, хвостовые пробелы и пустые строки в конце.
+
+    Номера строк не меняются, поэтому tracebacks в сохраненном выводе остаются верными.
+    """
+    lines = code.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).rstrip("\n")
+
+
+def is_deterministic(code: str) -> bool:
+    """Грубая проверка: код не импортирует модули, дающие разный результат на каждом запуске."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        # Синтаксическая ошибка воспроизводится всегда одинаково
+        return True
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            names = [node.module or ""]
+        elif isinstance(node, ast.Name) and node.id == "__import__":
+            return False
+        else:
+            continue
+        if any(name.split(".")[0] in NONDETERMINISTIC_MODULES for name in names):
+            return False
+    return True
+
+
+def make_key(code: str, test_code: str, runner_version: str) -> str:
+    """Ключ кэша: хэш от нормализованного кода, кода теста и версии раннера.
+
+    Код теста входит в ключ целиком, поэтому после изменения тестов урока
+    старые записи больше не находятся и вытесняются по TTL/LRU.
+    """
+    digest = hashlib.sha256()
+    for part in (runner_version, test_code, normalize_code(code)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Потокобезопасный LRU-кэш результатов проверки с TTL."""
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                metrics.inc("result_cache.misses")
+                return None
+            self._entries.move_to_end(key)
+        metrics.inc("result_cache.hits")
+        return copy.deepcopy(entry[1])
+
+    def put(self, key: str, result: dict):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.inc("result_cache.evictions")
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,51 @@
+import threading
+from collections import OrderedDict, deque
+
+import metrics
+
+
+class AdaptiveTimeouts:
+    """Лимиты времени по урокам, подстроенные под наблюдаемое время верных решений.
+
+    Пока по уроку мало замеров, используется лимит по умолчанию для типа теста.
+    Дальше лимит = p95 времени успешных запусков * `multiplier`, зажатый в
+    [`min_timeout`, `max_timeout`]. Так легкие уроки не держат воркер 5-10 секунд
+    на бесконечном цикле, а тяжелые не валятся по таймауту из-за общего лимита.
+    """
+
+    def __init__(self, defaults: dict, min_timeout: float, max_timeout: float,
+                 multiplier: float = 3.0, min_samples: int = 20, window: int = 200,
+                 max_lessons: int = 10000):
+        self.defaults = defaults
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self.window = window
+        self.max_lessons = max_lessons
+        self._samples = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, lesson_id, test_type: str) -> float:
+        default = self.defaults.get(test_type, self.max_timeout)
+        with self._lock:
+            samples = self._samples.get(lesson_id)
+            if samples is None or len(samples) < self.min_samples:
+                return default
+            values = list(samples)
+        timeout = metrics.percentile(values, 0.95) * self.multiplier
+        return round(min(self.max_timeout, max(self.min_timeout, timeout)), 2)
+
+    def record(self, lesson_id, seconds: float):
+        """Запоминает время успешного запуска (таймауты и ошибки не учитываются)."""
+        if lesson_id is None:
+            return
+        with self._lock:
+            samples = self._samples.get(lesson_id)
+            if samples is None:
+                samples = self._samples[lesson_id] = deque(maxlen=self.window)
+                if len(self._samples) > self.max_lessons:
+                    self._samples.popitem(last=False)
+            else:
+                self._samples.move_to_end(lesson_id)
+            samples.append(seconds)
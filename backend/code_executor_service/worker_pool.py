@@ -0,0 +1,327 @@
+import io
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+from output_capture import OutputWatcher, describe_resources, set_limits, watch_child
+
+
+def _run_code(code: str) -> int:
+    """Выполняет код пользователя так же, как `python -c`, и возвращает код выхода."""
+    status = 0
+    try:
+        exec(compile(code, "<string>", "exec"), {"__name__": "__main__", "__builtins__": __builtins__})
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            status = 1
+    except BaseException:
+        etype, value, tb = sys.exc_info()
+        # Пропускаем кадр самого воркера, чтобы traceback выглядел как у `python -c`
+        traceback.print_exception(etype, value, tb.tb_next if tb else None)
+        status = 1
+    return status
+
+
+class _ResultCollector:
+    """Плагин pytest, который собирает итоги прогона в структурированном виде."""
+
+    def __init__(self):
+        self.passed = 0
+        self.failed = 0
+        self.errors = 0
+        self.failures = []
+
+    def pytest_collectreport(self, report):
+        if report.failed:
+            self.errors += 1
+            self.failures.append({"test": report.nodeid, "message": report.longreprtext})
+
+    def pytest_runtest_logreport(self, report):
+        if report.when == "call":
+            if report.passed:
+                self.passed += 1
+            elif report.failed:
+                self.failed += 1
+                self.failures.append({"test": report.nodeid, "message": report.longreprtext})
+        elif report.failed:
+            # Упал setup/teardown - считаем ошибкой теста
+            self.errors += 1
+            self.failures.append({"test": report.nodeid, "message": report.longreprtext})
+
+
+def _run_pytest(workdir: str, args: list, result_fd: int) -> int:
+    """Запускает pytest в папке посылки и пишет структурированный итог в result_fd."""
+    import pytest
+
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)  # Аналог PYTHONPATH=. у CLI-запуска
+    collector = _ResultCollector()
+    exit_code = 1
+    try:
+        exit_code = int(pytest.main(args, plugins=[collector]))
+    except BaseException:
+        traceback.print_exc()
+    report = {
+        "exit_code": exit_code,
+        "passed": collector.passed,
+        "failed": collector.failed,
+        "errors": collector.errors,
+        "failures": collector.failures,
+    }
+    with open(result_fd, "w", encoding="utf-8", closefd=False) as f:
+        json.dump(report, f, ensure_ascii=False)
+    return exit_code
+
+
+def _run_child(job: dict, out_fd: int, err_fd: int, result_fd: int, cpu_limit: int):
+    """Выполняется в форкнутом дочернем процессе: изолирует его и запускает задание."""
+    os.setsid()  # Своя группа процессов - убиваем вместе со всеми потомками
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.dup2(out_fd, 1)
+    os.dup2(err_fd, 2)
+    os.dup2(result_fd, 3)
+    # Закрываем все унаследованные дескрипторы (канал к пулу и т.д.)
+    os.closerange(4, os.sysconf("SC_OPEN_MAX"))
+    set_limits(cpu_limit, job.get("memory_limit", 0))
+
+    sys.stdin = open(0, "r", encoding="utf-8", closefd=False)
+    # Без буфера, как у `python -u`: иначе вывод приходит пачками по 8 КБ или только
+    # при выходе, и расхождение с ожидаемым выводом не замечается вовремя
+    sys.stdout = io.TextIOWrapper(open(1, "wb", buffering=0, closefd=False), encoding="utf-8", write_through=True)
+    sys.stderr = io.TextIOWrapper(open(2, "wb", buffering=0, closefd=False), encoding="utf-8", write_through=True)
+
+    status = 1
+    try:
+        if job["kind"] == "pytest":
+            status = _run_pytest(job["workdir"], job["args"], 3)
+        else:
+            os.close(3)
+            status = _run_code(job["code"])
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except Exception:
+            pass
+        os._exit(status & 0xFF)
+
+
+def _execute(job: dict, timeout: float) -> dict:
+    """Форкает дочерний процесс под одно задание и собирает его stdout/stderr."""
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    res_r, res_w = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    pid = os.fork()
+    if pid == 0:
+        os.close(out_r)
+        os.close(err_r)
+        os.close(res_r)
+        _run_child(job, out_w, err_w, res_w, cpu_limit=int(timeout) + 1)
+    os.close(out_w)
+    os.close(err_w)
+    os.close(res_w)
+
+    watcher = OutputWatcher(job.get("expected_output"), job.get("max_output_bytes", 65536))
+    started = time.monotonic()
+    deadline = started + timeout
+    collected, status, rusage = watch_child(pid, {out_r: "stdout", err_r: "stderr", res_r: "report"}, deadline, watcher)
+    stop_reason = collected["stop_reason"]
+    timed_out = collected["timed_out"]
+
+    for fd in (out_r, err_r, res_r):
+        os.close(fd)
+
+    report = None
+    if collected["report"] and stop_reason is None and not timed_out:
+        try:
+            report = json.loads(collected["report"].decode("utf-8"))
+        except ValueError:
+            report = None
+    return {
+        "returncode": os.waitstatus_to_exitcode(status),
+        "stdout": watcher.stdout,
+        "stderr": watcher.stderr,
+        "report": report,
+        "stop_reason": stop_reason,
+        "timed_out": timed_out,
+        "resources": describe_resources(rusage, time.monotonic() - started, watcher),
+    }
+
+
+def _preload_pytest():
+    """Заранее импортирует pytest, его встроенные и установленные плагины."""
+    import importlib
+    import importlib.metadata
+    from _pytest.config import default_plugins
+
+    for name in default_plugins:
+        importlib.import_module(f"_pytest.{name}")
+    for entry_point in importlib.metadata.entry_points(group="pytest11"):
+        try:
+            entry_point.load()
+        except Exception:
+            pass
+
+
+def _worker_main(conn, max_runs: int, preload_pytest: bool):
+    """Цикл прогретого воркера: принимает задание, выполняет его в форке, отдает результат."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if preload_pytest:
+        _preload_pytest()
+    for _ in range(max_runs):
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        conn.send(_execute(job, job["timeout"]))
+    # После max_runs запусков воркер завершается, пул поднимет новый
+
+
+class _Worker:
+    def __init__(self, ctx, max_runs: int, preload_pytest: bool):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main, args=(child_conn, max_runs, preload_pytest), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.runs = 0
+
+    def stop(self):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+
+class WorkerPool:
+    """Пул заранее запущенных Python-воркеров.
+
+    Каждый воркер - отдельный интерпретатор, который на каждую посылку форкает
+    изолированный дочерний процесс. Воркер пересоздается после `max_runs`
+    запусков или если он упал/завис. С `preload_pytest=True` воркер заранее
+    импортирует pytest и плагины, и юнит-тесты не платят за старт pytest.
+    """
+
+    def __init__(self, size: int, max_runs: int = 100, preload_pytest: bool = False):
+        self.size = size
+        self.max_runs = max_runs
+        self.preload_pytest = preload_pytest
+        # spawn, а не fork: воркер не должен наследовать соединение с RabbitMQ
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def start(self):
+        for _ in range(self.size):
+            self._idle.put(self._new_worker())
+        print(
+            f"Worker pool: started {self.size} workers "
+            f"(max_runs={self.max_runs}, preload_pytest={self.preload_pytest})",
+            flush=True,
+        )
+
+    def _new_worker(self) -> _Worker:
+        return _Worker(self._ctx, self.max_runs, self.preload_pytest)
+
+    def _submit(self, job: dict, timeout: float) -> dict:
+        """Отдает задание свободному воркеру и ждет ответ.
+
+        Если задание не уложилось в лимит, в ответе будет timed_out=True. Если не ответил
+        сам воркер (упал или завис), бросает `subprocess.TimeoutExpired`.
+        """
+        job = dict(job, timeout=timeout)
+        worker = self._idle.get()
+        try:
+            worker.conn.send(job)
+            # Даем воркеру запас времени на то, чтобы убить дочерний процесс и ответить
+            if not worker.conn.poll(timeout + 5):
+                raise RuntimeError("worker did not respond")
+            reply = worker.conn.recv()
+        except Exception:
+            # Воркер упал или завис - заменяем его и считаем запуск превысившим лимит
+            worker.stop()
+            self._replace()
+            raise subprocess.TimeoutExpired(job["kind"], timeout)
+
+        worker.runs += 1
+        if worker.runs >= self.max_runs:
+            worker.stop()
+            self._replace()
+        else:
+            self._idle.put(worker)
+
+        return reply
+
+    def run(self, code: str, timeout: float, expected_output: str = None,
+            max_output_bytes: int = 65536, memory_limit: int = 0) -> dict:
+        """Выполняет код в одном из воркеров.
+
+        Вывод читается потоково: при расхождении с `expected_output` или превышении
+        `max_output_bytes` процесс убивается сразу, а в ответе выставляется stop_reason.
+        Возвращает словарь с returncode, stdout, stderr, stop_reason, timed_out и
+        resources - затратами запуска (время, процессор, пиковая память, объем вывода).
+        """
+        job = {
+            "kind": "code",
+            "code": code,
+            "expected_output": expected_output,
+            "max_output_bytes": max_output_bytes,
+            "memory_limit": memory_limit,
+        }
+        return self._submit(job, timeout)
+
+    def run_pytest(self, workdir: str, args: list, timeout: float,
+                   max_output_bytes: int = 65536, memory_limit: int = 0) -> dict:
+        """Запускает pytest в папке посылки внутри форка прогретого воркера.
+
+        Возвращает то же, что run(), плюс report - итоги прогона
+        (passed/failed/errors и тексты упавших проверок).
+        """
+        job = {
+            "kind": "pytest",
+            "workdir": workdir,
+            "args": args,
+            "max_output_bytes": max_output_bytes,
+            "memory_limit": memory_limit,
+        }
+        return self._submit(job, timeout)
+
+    def _replace(self):
+        # Старт нового интерпретатора занимает сотни миллисекунд - не держим на этом посылку
+        threading.Thread(target=self._spawn, daemon=True).start()
+
+    def _spawn(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._idle.put(self._new_worker())
+
+    def shutdown(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
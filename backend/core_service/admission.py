@@ -0,0 +1,105 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Сколько секунд одинаковая посылка (тот же пользователь, урок и код) считается той же самой,
+# пока по ней нет результата
+SUBMISSION_DEDUP_WINDOW = float(os.getenv("SUBMISSION_DEDUP_WINDOW", "60"))
+# Сколько секунд занятый ключ без документа в Mongo считается вставляемым параллельным запросом;
+# дольше - запрос, занявший ключ, не дошел до записи, и ключ забирает новая посылка
+SUBMISSION_INSERT_GRACE = float(os.getenv("SUBMISSION_INSERT_GRACE", "5"))
+# Пользователь может отправить SUBMISSION_BURST посылок подряд, дальше - SUBMISSION_RATE в секунду
+SUBMISSION_RATE = float(os.getenv("SUBMISSION_RATE", "0.5"))
+SUBMISSION_BURST = int(os.getenv("SUBMISSION_BURST", "5"))
+# Сколько пользователей помним в ограничителе (давно не отправлявшие вытесняются первыми)
+SUBMISSION_LIMITER_SIZE = int(os.getenv("SUBMISSION_LIMITER_SIZE", "100000"))
+
+
+def code_hash(code: str) -> str:
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+class InflightSubmissions:
+    """Посылки без результата по ключу (user_id, lesson_id, хэш кода) внутри процесса.
+
+    Ключ занимается синхронно, до первого await, поэтому два одновременных клика
+    в одном процессе не создадут две посылки.
+    """
+
+    def __init__(self, window: float = SUBMISSION_DEDUP_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # ключ -> (время, submission_id)
+
+    def claim(self, key, submission_id: str):
+        """Регистрирует submission_id под ключом или возвращает уже зарегистрированный.
+
+        Возвращает (submission_id, сколько секунд назад он занял ключ).
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._entries:
+                oldest_time, _ = next(iter(self._entries.values()))
+                if now - oldest_time < self.window:
+                    break
+                self._entries.popitem(last=False)
+            existing = self._entries.get(key)
+            if existing is not None:
+                return existing[1], now - existing[0]
+            self._entries[key] = (now, submission_id)
+            return submission_id, 0.0
+
+    def replace(self, key, submission_id: str):
+        """Заменяет посылку под ключом (прежняя уже завершилась)."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic(), submission_id)
+
+    def release(self, key, submission_id: str):
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None and existing[1] == submission_id:
+                del self._entries[key]
+
+
+class SubmissionLimiter:
+    """Token bucket на пользователя: ограничивает частоту посылок."""
+
+    def __init__(self, rate: float = SUBMISSION_RATE, burst: int = SUBMISSION_BURST,
+                 max_users: int = SUBMISSION_LIMITER_SIZE):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # user_id -> (токены, время обновления)
+
+    def acquire(self, user_id: int) -> float:
+        """Забирает токен. Возвращает 0, если посылку можно принять, иначе - через сколько секунд повторить."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(user_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                retry_after = 0.0
+            else:
+                retry_after = (1 - tokens) / self.rate
+            self._buckets[user_id] = (tokens, now)
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        if retry_after:
+            metrics.inc("submit.rate_limited")
+        return retry_after
+
+
+def retry_after_header(seconds: float) -> dict:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+inflight = InflightSubmissions()
+limiter = SubmissionLimiter()
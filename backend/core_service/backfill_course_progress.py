@@ -0,0 +1,20 @@
+"""Разовый перенос прогресса в user_course_progress.
+
+Запускать один раз после обновления, в котором появилась таблица user_course_progress
+(можно на уже работающем сервисе и повторно - строки дополняются недостающими уроками):
+
+    docker compose exec core_service python backfill_course_progress.py
+"""
+import crud
+import models
+from database import SessionLocal, engine
+
+
+if __name__ == "__main__":
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        rows = crud.backfill_course_progress(db)
+    finally:
+        db.close()
+    print(f"Course progress rows written: {rows}", flush=True)
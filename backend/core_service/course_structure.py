@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, joinedload
+
+import models
+import schemas
+
+# Сколько секунд доверяем построенным индексам. Изменения через ORM этого процесса
+# сбрасывают их сразу, TTL нужен для правок из других процессов и напрямую в БД.
+COURSE_STRUCTURE_TTL = float(os.getenv("COURSE_STRUCTURE_TTL", "300"))
+
+_STRUCTURE_MODELS = (models.Course, models.Module, models.Lesson, models.Question)
+
+_lock = threading.Lock()
+_navigation = {}  # course_id -> (время построения, {lesson_id: LessonNavigation})
+_trees = {}  # course_id -> (время построения, CourseTree)
+_answer_keys = {}  # lesson_id -> (время загрузки, {question_id: правильный ответ})
+_lesson_infos = {}  # lesson_id -> (время загрузки, краткие данные урока)
+_lesson_contexts = {}  # lesson_id -> (время загрузки, контекст урока для AI-сервиса)
+
+# Метка на месте флага completed в сериализованном дереве. Случайная часть не дает
+# совпасть с текстом уроков, поэтому флаги можно подставлять прямо в байты.
+_COMPLETED_MARK = f"__completed_{uuid.uuid4().hex}_"
+_COMPLETED_RE = re.compile(f'"{_COMPLETED_MARK}(\\d+)"'.encode())
+
+
+class LessonNavigation:
+    __slots__ = ("position", "prev_lesson", "next_lesson")
+
+    def __init__(self, position: int, prev_lesson, next_lesson):
+        self.position = position
+        self.prev_lesson = prev_lesson
+        self.next_lesson = next_lesson
+
+
+class CourseTree:
+    """Дерево курса (модули и уроки), заранее сериализованное в JSON.
+
+    Общая для всех пользователей часть хранится кусками байт, между которыми
+    подставляются флаги completed конкретного пользователя - без повторной
+    сборки моделей и валидации всего дерева.
+    """
+
+    __slots__ = ("version", "_parts")
+
+    def __init__(self, body: bytes):
+        # Версия - от содержимого без меток, чтобы ETag совпадал во всех процессах
+        self.version = hashlib.sha256(_COMPLETED_RE.sub(b"false", body)).hexdigest()[:16]
+        # [кусок, id урока, кусок, id урока, ..., кусок]
+        parts = _COMPLETED_RE.split(body)
+        self._parts = [int(part) if i % 2 else part for i, part in enumerate(parts)]
+
+    def render(self, completed_ids) -> bytes:
+        parts = self._parts
+        chunks = [parts[0]]
+        for i in range(1, len(parts), 2):
+            chunks.append(b"true" if parts[i] in completed_ids else b"false")
+            chunks.append(parts[i + 1])
+        return b"".join(chunks)
+
+
+def invalidate():
+    """Сбрасывает все индексы структуры курсов (после изменения курсов, модулей, уроков или вопросов)."""
+    with _lock:
+        _navigation.clear()
+        _trees.clear()
+        _answer_keys.clear()
+        _lesson_infos.clear()
+        _lesson_contexts.clear()
+
+
+def _navigation_query(course_id: int):
+    # Только нужные колонки, в порядке прохождения курса (по ID модулей, потом по ID уроков)
+    return select(models.Lesson.id, models.Lesson.lesson_type).join(models.Module)\
+        .where(models.Module.course_id == course_id)\
+        .order_by(models.Module.id, models.Lesson.id)
+
+
+def _index_navigation(rows) -> dict:
+    links = [schemas.LessonLink(id=lesson_id, lesson_type=lesson_type) for lesson_id, lesson_type in rows]
+    index = {}
+    for position, link in enumerate(links):
+        index[link.id] = LessonNavigation(
+            position,
+            links[position - 1] if position > 0 else None,
+            links[position + 1] if position < len(links) - 1 else None,
+        )
+    return index
+
+
+def _get_fresh(cache: dict, key):
+    with _lock:
+        cached = cache.get(key)
+    if cached is None or time.monotonic() - cached[0] >= COURSE_STRUCTURE_TTL:
+        return None
+    return cached[1]
+
+
+def _store(cache: dict, key, value):
+    with _lock:
+        cache[key] = (time.monotonic(), value)
+    return value
+
+
+def get_lesson_navigation(db, course_id: int, lesson_id: int):
+    """Позиция урока в курсе и ссылки на соседние уроки или None, если урока нет в индексе."""
+    index = _get_fresh(_navigation, course_id)
+    if index is None:
+        index = _store(_navigation, course_id, _index_navigation(db.execute(_navigation_query(course_id)).all()))
+    return index.get(lesson_id)
+
+
+async def get_lesson_navigation_async(db, course_id: int, lesson_id: int):
+    """То же, что get_lesson_navigation, для AsyncSession."""
+    index = _get_fresh(_navigation, course_id)
+    if index is None:
+        rows = (await db.execute(_navigation_query(course_id))).all()
+        index = _store(_navigation, course_id, _index_navigation(rows))
+    return index.get(lesson_id)
+
+
+def _build_tree(db, course_id: int):
+    # Модули и уроки грузим одним запросом вместо ленивой загрузки (N+1)
+    db_course = db.query(models.Course)\
+        .options(joinedload(models.Course.modules).joinedload(models.Module.lessons))\
+        .filter(models.Course.id == course_id).first()
+    if db_course is None:
+        return None
+    data = schemas.CourseFull.model_validate(db_course).model_dump(mode="json")
+    # Порядок прохождения курса, как в навигации: по ID модулей, потом по ID уроков
+    data["modules"].sort(key=lambda module: module["id"])
+    for module in data["modules"]:
+        module["lessons"].sort(key=lambda lesson: lesson["id"])
+        for lesson in module["lessons"]:
+            lesson["completed"] = f"{_COMPLETED_MARK}{lesson['id']}"
+    return CourseTree(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def get_course_tree(db, course_id: int):
+    """Сериализованное дерево курса или None, если курса нет."""
+    tree = _get_fresh(_trees, course_id)
+    if tree is None:
+        tree = _build_tree(db, course_id)
+        if tree is None:
+            return None
+        _store(_trees, course_id, tree)
+    return tree
+
+
+def get_answer_key(db, lesson_id: int) -> dict:
+    """Правильные ответы квиза урока: {question_id: correct_answer}."""
+    answer_key = _get_fresh(_answer_keys, lesson_id)
+    if answer_key is None:
+        rows = db.query(models.Question.id, models.Question.details)\
+            .filter(models.Question.lesson_id == lesson_id).all()
+        answer_key = _store(_answer_keys, lesson_id, {question_id: details.get("correct_answer") for question_id, details in rows})
+    return answer_key
+
+
+def get_lesson_infos(db, lesson_ids) -> dict:
+    """Краткие данные уроков для внутренних вызовов: {lesson_id: {id, title, course_id, lesson_type}}.
+
+    Уроков, которых нет (или которые не привязаны к курсу), в ответе нет.
+    Незакэшированные уроки грузятся одним запросом.
+    """
+    infos = {}
+    missing = []
+    for lesson_id in dict.fromkeys(lesson_ids):
+        info = _get_fresh(_lesson_infos, lesson_id)
+        if info is None:
+            missing.append(lesson_id)
+        else:
+            infos[lesson_id] = info
+    if missing:
+        rows = db.execute(
+            select(models.Lesson.id, models.Lesson.title, models.Module.course_id, models.Lesson.lesson_type)
+            .join(models.Module).where(models.Lesson.id.in_(missing))
+        ).all()
+        for lesson_id, title, course_id, lesson_type in rows:
+            infos[lesson_id] = _store(_lesson_infos, lesson_id, {
+                "id": lesson_id, "title": title, "course_id": course_id, "lesson_type": lesson_type
+            })
+    return infos
+
+
+def get_lesson_context(db, lesson_id: int):
+    """Контекст урока для AI-сервиса (content, test_code, expected_constructs) или None, если урока нет."""
+    context = _get_fresh(_lesson_contexts, lesson_id)
+    if context is None:
+        row = db.execute(
+            select(models.Lesson.content, models.Lesson.test_code, models.Lesson.expected_constructs)
+            .where(models.Lesson.id == lesson_id)
+        ).first()
+        if row is None:
+            # Отсутствие урока не кэшируем: он может появиться в любой момент
+            return None
+        content, test_code, expected_constructs = row
+        context = _store(_lesson_contexts, lesson_id, {
+            "lesson_content": content,
+            "test_code": test_code,
+            "expected_constructs": expected_constructs
+        })
+    return context
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_structure_change(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, _STRUCTURE_MODELS):
+            session.info["course_structure_changed"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_structure_change(session):
+    # Сбрасываем только после коммита: иначе другой запрос успел бы перестроить индекс по старым данным
+    if session.info.pop("course_structure_changed", False):
+        invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_structure_change(session):
+    session.info.pop("course_structure_changed", None)
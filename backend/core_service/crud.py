@@ -1,35 +1,45 @@
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import hashlib
 import models
 import schemas
+import course_structure
 from typing import List
-from passlib.context import CryptContext
 
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 def get_user_by_email(db: Session, email: str):
     """Найти пользователя по email."""
     return db.query(models.User).filter(models.User.email == email).first()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    """Создать нового пользователя."""
+async def get_user_by_email_async(db: AsyncSession, email: str):
+    """Найти пользователя по email (асинхронная сессия)."""
+    result = await db.execute(select(models.User).where(models.User.email == email))
+    return result.scalars().first()
 
-    hashed_password = pwd_context.hash(user.password)
-    
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
+    """Создать нового пользователя (пароль хэшируется заранее, в passwords)."""
     db_user = models.User(email=user.email, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     return db_user
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Проверить, соответствует ли пароль хэшу."""
-    return pwd_context.verify(plain_password, hashed_password)
+def update_password_hash(db: Session, user: models.User, hashed_password: str):
+    """Сохранить пересчитанный хэш пароля (после смены параметров хэширования)."""
+    user.hashed_password = hashed_password
+    db.commit()
 
 def get_courses(db: Session, skip: int = 0, limit: int = 100):
     """Получить список всех курсов."""
     return db.query(models.Course).offset(skip).limit(limit).all()
 
+async def get_courses_async(db: AsyncSession, skip: int = 0, limit: int = 100):
+    """Получить список всех курсов (асинхронная сессия)."""
+    result = await db.execute(select(models.Course).offset(skip).limit(limit))
+    return result.scalars().all()
+
 def create_course(db: Session, title: str, description: str):
     """ (Вспомогательная функция) Создать тестовый курс. """
     db_course = models.Course(title=title, description=description)
@@ -44,108 +54,210 @@ def get_course_by_id(db: Session, course_id: int):
 
 def get_lesson_with_navigation(db: Session, lesson_id: int):
     """Находит урок и ID предыдущего/следующего урока в рамках всего курса."""
-    current_lesson = db.query(models.Lesson).filter(models.Lesson.id == lesson_id).first()
-    if not current_lesson:
-        return None
-
-    # Собираем все уроки курса в правильном порядке (по ID модулей, потом по ID уроков)
-    all_lessons = db.query(models.Lesson).join(models.Module)\
-        .filter(models.Module.course_id == current_lesson.module.course_id)\
-        .order_by(models.Module.id, models.Lesson.id).all()
-    
-    # Находим индекс текущего урока в этом списке
-    try:
-        current_index = [lesson.id for lesson in all_lessons].index(lesson_id)
-    except ValueError:
+    row = db.query(models.Lesson, models.Module.course_id).join(models.Module)\
+        .filter(models.Lesson.id == lesson_id).first()
+    if not row:
+        # Урок без модуля (или его нет вовсе) - навигации у него нет
+        return get_lesson_by_id(db, lesson_id)
+    current_lesson, course_id = row
+
+    # Соседей берем из индекса курса, который перестраивается только при изменении структуры
+    navigation = course_structure.get_lesson_navigation(db, course_id, lesson_id)
+    if navigation is None:
         return current_lesson # Если что-то пошло не так, вернем просто урок
 
-    # Определяем сос-дей
-    prev_lesson = all_lessons[current_index - 1] if current_index > 0 else None
-    next_lesson = all_lessons[current_index + 1] if current_index < len(all_lessons) - 1 else None
-    
     # Добавляем навигацию к нашему объекту урока
-    current_lesson.prev_lesson = prev_lesson
-    current_lesson.next_lesson = next_lesson
+    current_lesson.prev_lesson = navigation.prev_lesson
+    current_lesson.next_lesson = navigation.next_lesson
     
     return current_lesson
 
+async def get_lesson_with_navigation_async(db: AsyncSession, lesson_id: int):
+    """То же, что get_lesson_with_navigation, для асинхронной сессии."""
+    result = await db.execute(
+        select(models.Lesson, models.Module.course_id).join(models.Module)
+        .where(models.Lesson.id == lesson_id)
+    )
+    row = result.first()
+    if not row:
+        return await get_lesson_by_id_async(db, lesson_id)
+    current_lesson, course_id = row
+
+    navigation = await course_structure.get_lesson_navigation_async(db, course_id, lesson_id)
+    if navigation is None:
+        return current_lesson
+
+    current_lesson.prev_lesson = navigation.prev_lesson
+    current_lesson.next_lesson = navigation.next_lesson
+    return current_lesson
+
 def get_lesson_by_id(db: Session, lesson_id: int):
     """Получить один урок по его ID."""
     return db.query(models.Lesson).filter(models.Lesson.id == lesson_id).first()
 
+async def get_lesson_by_id_async(db: AsyncSession, lesson_id: int):
+    """Получить один урок по его ID (асинхронная сессия)."""
+    return await db.get(models.Lesson, lesson_id)
+
+def get_test_spec_version(test_code: str) -> str:
+    """Версия спецификации тестов урока - хэш от test_code.
+
+    Любое изменение тестов дает новую версию, а старая версия навсегда
+    соответствует старому коду тестов, поэтому executor может кэшировать спецификации.
+    """
+    return hashlib.sha256(test_code.encode("utf-8")).hexdigest()[:16]
+
 def mark_lesson_as_completed(db: Session, user_id: int, lesson_id: int):
-    """Отметить урок как пройденный для пользователя."""
-    db_progress = db.query(models.UserLessonProgress).filter_by(user_id=user_id, lesson_id=lesson_id).first()
-    if not db_progress:
-        db_progress = models.UserLessonProgress(user_id=user_id, lesson_id=lesson_id)
-        db.add(db_progress)
-        db.commit()
-        db.refresh(db_progress)
-    return db_progress
+    """Отметить урок как пройденный для пользователя (повторная отметка ничего не меняет)."""
+    mark_lessons_as_completed(db, [(user_id, lesson_id)])
+
+def insert_completions(db: Session, pairs):
+    """Добавить отметки о прохождении одним INSERT в текущую транзакцию (без commit).
+
+    Вместе с ними обновляется прогресс по курсам (UserCourseProgress) - только для
+    действительно новых отметок, поэтому повторы не увеличивают счетчики.
+    """
+    rows = [{"user_id": user_id, "lesson_id": lesson_id} for user_id, lesson_id in set(pairs)]
+    if not rows:
+        return
+    stmt = pg_insert(models.UserLessonProgress).values(rows)\
+        .on_conflict_do_nothing(constraint='_user_lesson_uc')\
+        .returning(models.UserLessonProgress.user_id, models.UserLessonProgress.lesson_id)
+    inserted = db.execute(stmt).all()
+    if not inserted:
+        return
+
+    lesson_courses = dict(db.execute(
+        select(models.Lesson.id, models.Module.course_id).join(models.Module)
+        .where(models.Lesson.id.in_({lesson_id for _, lesson_id in inserted}))
+    ).all())
+    progress = {}
+    for user_id, lesson_id in inserted:
+        course_id = lesson_courses.get(lesson_id)
+        if course_id is not None:
+            progress.setdefault((user_id, course_id), []).append(lesson_id)
+    if not progress:
+        return
+
+    # Строки в одном порядке, чтобы параллельные пачки брали блокировки без взаимоблокировок
+    stmt = pg_insert(models.UserCourseProgress).values([
+        {"user_id": user_id, "course_id": course_id, "completed_lesson_ids": lesson_ids, "completed_count": len(lesson_ids)}
+        for (user_id, course_id), lesson_ids in sorted(progress.items())
+    ])
+    # Дописываем в массив только что вставленные уроки - их там еще нет
+    table = models.UserCourseProgress.__table__
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.user_id, table.c.course_id],
+        set_={
+            "completed_lesson_ids": table.c.completed_lesson_ids.concat(stmt.excluded.completed_lesson_ids),
+            "completed_count": table.c.completed_count + stmt.excluded.completed_count,
+            "updated_at": func.now(),
+        }
+    )
+    db.execute(stmt)
+
+def mark_lessons_as_completed(db: Session, pairs):
+    """Отметить пачку уроков пройденными одним INSERT; уже отмеченные пропускаются."""
+    insert_completions(db, pairs)
+    db.commit()
+
+def backfill_course_progress(db: Session):
+    """Пересчитывает UserCourseProgress по user_lesson_progress для всех пар (пользователь, курс).
+
+    Разовая миграция (см. backfill_course_progress.py) для прогресса, отмеченного до появления
+    user_course_progress. Существующие строки дополняются недостающими уроками, поэтому запуск
+    безопасен и на работающем сервисе, и повторно.
+    """
+    lessons = select(
+        models.UserLessonProgress.user_id,
+        models.Module.course_id,
+        func.array_agg(models.UserLessonProgress.lesson_id),
+        func.count(),
+    ).join(models.Lesson, models.Lesson.id == models.UserLessonProgress.lesson_id)\
+        .join(models.Module)\
+        .group_by(models.UserLessonProgress.user_id, models.Module.course_id)
+    stmt = pg_insert(models.UserCourseProgress).from_select(
+        ["user_id", "course_id", "completed_lesson_ids", "completed_count"], lessons
+    )
+    # Объединяем, а не заменяем: отметка, записанная на работающем сервисе после снимка
+    # user_lesson_progress в этом запросе, не должна потеряться
+    merged = "ARRAY(SELECT DISTINCT unnest(user_course_progress.completed_lesson_ids || excluded.completed_lesson_ids))"
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "course_id"],
+        set_={
+            "completed_lesson_ids": literal_column(merged),
+            "completed_count": literal_column(f"cardinality({merged})"),
+            "updated_at": func.now(),
+        }
+    )
+    result = db.execute(stmt)
+    db.commit()
+    return result.rowcount
 
 def get_completed_lessons_for_user(db: Session, user_id: int, course_id: int):
     """Получить ID всех пройденных уроков пользователя в рамках одного курса."""
-    completed_lessons = db.query(models.UserLessonProgress.lesson_id)\
-        .join(models.Lesson)\
-        .filter(
-            models.UserLessonProgress.user_id == user_id,
-            models.Lesson.module.has(course_id=course_id)
-        ).all()
-    return {lesson_id for lesson_id, in completed_lessons}
+    completed = db.query(models.UserCourseProgress.completed_lesson_ids)\
+        .filter_by(user_id=user_id, course_id=course_id).scalar()
+    return set(completed or ())
 
 def get_questions_for_lesson(db: Session, lesson_id: int):
     """Получить все вопросы для урока-квиза."""
     return db.query(models.Question).filter(models.Question.lesson_id == lesson_id).all()
 
-def submit_quiz_answers(db: Session, user_id: int, answers: List[schemas.AnswerIn]):
-    """Проверить ответы на квиз и сохранить их."""
-    results = []
-    correct_count = 0
-    total_count = len(answers)
+def submit_quiz_answers(db: Session, user_id: int, lesson_id: int, answers: List[schemas.AnswerIn]):
+    """Проверить ответы на квиз и сохранить их.
+
+    Ответы сверяются с закэшированным ключом квиза и пишутся одним INSERT ... ON CONFLICT.
+    Если верно отвечены все вопросы квиза, урок отмечается пройденным в той же транзакции.
+    """
+    answer_key = course_structure.get_answer_key(db, lesson_id)
+    results = {}
+    rows = {}
 
     for answer in answers:
-        question = db.query(models.Question).filter(models.Question.id == answer.question_id).first()
-        if not question:
-            continue # Пропускаем, если вопрос не найден
+        if answer.question_id not in answer_key:
+            continue # Пропускаем, если вопрос не найден в этом квизе
 
-        correct_answer = question.details.get("correct_answer")
+        correct_answer = answer_key[answer.question_id]
         is_correct = (answer.answer == correct_answer)
-        if is_correct:
-            correct_count += 1
-        
-        # Сначала ищем существующий ответ
-        db_answer = db.query(models.QuizAnswer).filter_by(
-            user_id=user_id, 
-            question_id=answer.question_id
-        ).first()
-
-        if db_answer:
-            # Если ответ уже есть - ОБНОВЛЯЕМ его
-            db_answer.selected_answer = answer.answer
-            db_answer.is_correct = is_correct
-        else:
-            # Если ответа нет - СОЗДАЕМ новый
-            db_answer = models.QuizAnswer(
-                user_id=user_id,
-                question_id=answer.question_id,
-                selected_answer=answer.answer,
-                is_correct=is_correct
-            )
-            db.add(db_answer)
-        
-        results.append({
+
+        # Повтор одного вопроса в запросе: учитываем последний ответ (одна строка на вопрос в INSERT)
+        rows[answer.question_id] = {
+            "user_id": user_id,
+            "question_id": answer.question_id,
+            "selected_answer": answer.answer,
+            "is_correct": is_correct
+        }
+        results[answer.question_id] = {
             "question_id": answer.question_id,
             "is_correct": is_correct,
             "correct_answer": correct_answer
-        })
-    
-    # Коммитим все изменения (и новые, и обновленные) один раз
+        }
+
+    if rows:
+        # Существующие ответы ОБНОВЛЯЕМ, новые СОЗДАЕМ - одним запросом
+        stmt = pg_insert(models.QuizAnswer).values(list(rows.values()))
+        stmt = stmt.on_conflict_do_update(
+            constraint='_user_question_uc',
+            set_={"selected_answer": stmt.excluded.selected_answer, "is_correct": stmt.excluded.is_correct}
+        )
+        db.execute(stmt)
+
+    # Считаем по вопросам квиза, а не по присланным ответам: повторы не засчитываются дважды,
+    # а пропущенный вопрос не дает пройти урок
+    correct_count = sum(1 for row in rows.values() if row["is_correct"])
+    total_count = len(answer_key)
+    completed = correct_count == total_count and total_count > 0
+    if completed:
+        insert_completions(db, [(user_id, lesson_id)])
+
+    # Коммитим ответы и отметку о прохождении один раз
     db.commit()
-    return {"results": results, "correct_count": correct_count, "total_count": total_count}
+    return {"results": list(results.values()), "correct_count": correct_count, "total_count": total_count, "completed": completed}
 
 def get_all_completed_lessons_for_user(db: Session, user_id: int):
     """Получить ID ВСЕХ пройденных уроков пользователя."""
-    completed_lessons = db.query(models.UserLessonProgress.lesson_id).filter(
-        models.UserLessonProgress.user_id == user_id
+    rows = db.query(models.UserCourseProgress.completed_lesson_ids).filter(
+        models.UserCourseProgress.user_id == user_id
     ).all()
-    return {lesson_id for lesson_id, in completed_lessons}
\ No newline at end of file
+    return {lesson_id for lesson_ids, in rows for lesson_id in lesson_ids}
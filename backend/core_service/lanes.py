@@ -0,0 +1,43 @@
+import os
+import threading
+
+# Очереди полос executor'а. Медленная полоса сохраняет старое имя submission_queue.
+FAST_LANE_QUEUE = "submission_fast_queue"
+SLOW_LANE_QUEUE = "submission_queue"
+
+# Урок со средним временем проверки больше порога (в секундах) уходит в медленную полосу
+SLOW_LANE_THRESHOLD = float(os.getenv("SLOW_LANE_THRESHOLD", "1.0"))
+# Вес нового замера в скользящем среднем времени проверки урока
+RUNTIME_EWMA_ALPHA = 0.2
+
+_lock = threading.Lock()
+_lesson_runtimes = {}
+
+
+def get_test_type(test_code: str) -> str:
+    """Тип теста из 'магического' комментария (как в code_executor_service)."""
+    for line in test_code.strip().split('\n'):
+        if line.strip().startswith("# test_type:"):
+            return line.split(":", 1)[1].strip()
+    return "unit"
+
+
+def record_runtime(lesson_id: int, seconds: float):
+    """Учитывает время очередной проверки урока (скользящее среднее)."""
+    with _lock:
+        previous = _lesson_runtimes.get(lesson_id)
+        if previous is None:
+            _lesson_runtimes[lesson_id] = seconds
+        else:
+            _lesson_runtimes[lesson_id] = previous + RUNTIME_EWMA_ALPHA * (seconds - previous)
+
+
+def choose_lane_queue(lesson_id: int, test_code: str) -> str:
+    """Выбирает очередь для посылки: по истории времени проверки урока, а без истории - по типу теста."""
+    with _lock:
+        runtime = _lesson_runtimes.get(lesson_id)
+    if runtime is not None:
+        return SLOW_LANE_QUEUE if runtime > SLOW_LANE_THRESHOLD else FAST_LANE_QUEUE
+    if test_code and get_test_type(test_code) == "stdout":
+        return FAST_LANE_QUEUE
+    return SLOW_LANE_QUEUE
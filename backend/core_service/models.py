@@ -3,7 +3,7 @@ from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
 from sqlalchemy import UniqueConstraint
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 
 class User(Base):
     __tablename__ = "users"
@@ -53,6 +53,19 @@ class UserLessonProgress(Base):
     # Гарантируем, что пара (user_id, lesson_id) будет уникальной
     __table_args__ = (UniqueConstraint('user_id', 'lesson_id', name='_user_lesson_uc'),)
 
+class UserCourseProgress(Base):
+    """Прогресс пользователя по курсу одной строкой: пройденные уроки и их число.
+
+    Поддерживается при каждой отметке о прохождении (crud.insert_completions),
+    чтобы страница курса и AI-сервис не собирали прогресс из user_lesson_progress.
+    """
+    __tablename__ = 'user_course_progress'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    course_id = Column(Integer, ForeignKey('courses.id'), primary_key=True)
+    completed_lesson_ids = Column(ARRAY(Integer), nullable=False, default=list)
+    completed_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class Question(Base):
     __tablename__ = 'questions'
     id = Column(Integer, primary_key=True, index=True)
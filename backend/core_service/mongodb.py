@@ -1,7 +1,87 @@
-from pymongo import MongoClient
+import asyncio
 import os
 
+from pymongo import ASCENDING, AsyncMongoClient
+from pymongo.errors import CollectionInvalid, OperationFailure
+
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://mongo_db:27017/")
-client = MongoClient(MONGO_URL)
-db = client.learning_platform # Название базы данных
-submissions_collection = db.submissions # Название коллекции
\ No newline at end of file
+MONGO_DB_NAME = "learning_platform" # Название базы данных
+# Размер пула соединений к Mongo на процесс
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "5"))
+# Лимит на одну операцию: драйвер передает его серверу как maxTimeMS и сам не ждет дольше
+MONGO_TIMEOUT_MS = int(os.getenv("MONGO_TIMEOUT_MS", "2000"))
+
+# Сколько дней храним проверенные посылки (код и вывод); 0 - хранить всегда
+SUBMISSION_RETENTION_DAYS = float(os.getenv("SUBMISSION_RETENTION_DAYS", "30"))
+# Блочное сжатие WiredTiger для новой коллекции посылок (zstd, snappy, zlib или none)
+MONGO_BLOCK_COMPRESSOR = os.getenv("MONGO_BLOCK_COMPRESSOR", "zstd")
+
+# Поля, которые нужны для ответа о статусе посылки (без кода и затрат запуска)
+SUBMISSION_STATUS_FIELDS = {"user_id": 1, "status": 1, "output": 1}
+# Поля, по которым слушатель находит владельца посылки
+SUBMISSION_OWNER_FIELDS = {"user_id": 1, "lesson_id": 1, "code": 1}
+
+_client = None
+_loop = None
+
+
+def init_async_client():
+    """Создает асинхронный клиент в цикле событий приложения (вызывается при старте)."""
+    global _client, _loop
+    _loop = asyncio.get_running_loop()
+    _client = AsyncMongoClient(
+        MONGO_URL,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        timeoutMS=MONGO_TIMEOUT_MS,
+    )
+
+
+async def close_async_client():
+    if _client is not None:
+        await _client.close()
+
+
+async def ensure_submission_storage():
+    """Создает коллекцию посылок со сжатием и нужные ей индексы (вызывается при старте).
+
+    Сжатие задается только при создании коллекции: уже существующая остается как есть.
+    """
+    db = _client[MONGO_DB_NAME]
+    try:
+        await db.create_collection(
+            "submissions",
+            storageEngine={"wiredTiger": {"configString": f"block_compressor={MONGO_BLOCK_COMPRESSOR}"}},
+        )
+        print(f"Mongo: created submissions collection ({MONGO_BLOCK_COMPRESSOR} compression)", flush=True)
+    except CollectionInvalid:
+        pass
+
+    collection = db.submissions
+    # Поиск такой же непроверенной посылки (см. find_inflight_submission); в индексе только pending
+    await collection.create_index(
+        [("user_id", ASCENDING), ("lesson_id", ASCENDING), ("code_hash", ASCENDING), ("created_at", ASCENDING)],
+        name="pending_dedup",
+        partialFilterExpression={"status": "pending"},
+    )
+    if SUBMISSION_RETENTION_DAYS > 0:
+        # Проверенные посылки удаляются сами через SUBMISSION_RETENTION_DAYS после результата
+        expire_after = int(SUBMISSION_RETENTION_DAYS * 86400)
+        try:
+            await collection.create_index("finished_at", name="finished_ttl", expireAfterSeconds=expire_after)
+        except OperationFailure as e:
+            if e.code not in (85, 86):  # индекс уже есть с другим сроком
+                raise
+            await db.command("collMod", "submissions", index={"name": "finished_ttl", "expireAfterSeconds": expire_after})
+
+
+def submissions():
+    """Коллекция посылок асинхронного клиента."""
+    return _client[MONGO_DB_NAME].submissions
+
+
+def run_from_thread(coro):
+    """Выполняет корутину в цикле приложения из другого потока (например, слушателя result_queue)
+    и ждет результат. Так у процесса один пул соединений к Mongo."""
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
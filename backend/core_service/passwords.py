@@ -0,0 +1,77 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+import metrics
+
+# Сколько хэшей bcrypt считается одновременно (bcrypt отпускает GIL, так что это реальные ядра)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+# Сколько операций может ждать очереди; сверх этого вход и регистрация отвечают 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "200"))
+# Стоимость bcrypt. Хэши с другой стоимостью пересчитываются при следующем входе.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    # min = max = текущей стоимости: needs_update срабатывает при любом ее изменении
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_pending_lock = threading.Lock()
+_pending = 0
+
+
+class PasswordHashingOverloaded(Exception):
+    """Очередь хэширования паролей переполнена."""
+
+
+def _timed(operation: str, func, args, queued_at: float):
+    global _pending
+    started = time.monotonic()
+    metrics.observe(f"auth.password.{operation}.queue_seconds", started - queued_at)
+    try:
+        return func(*args)
+    finally:
+        metrics.observe(f"auth.password.{operation}.run_seconds", time.monotonic() - started)
+        with _pending_lock:
+            _pending -= 1
+            metrics.set_gauge("auth.password.pending", _pending)
+
+
+async def _run(operation: str, func, *args):
+    """Выполняет операцию на выделенном пуле, не занимая поток обработки запросов."""
+    global _pending
+    with _pending_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            metrics.inc("auth.password.rejected")
+            raise PasswordHashingOverloaded(f"{_pending} password operations are already waiting")
+        _pending += 1
+        metrics.set_gauge("auth.password.pending", _pending)
+    try:
+        future = _executor.submit(_timed, operation, func, args, time.monotonic())
+    except Exception:
+        with _pending_lock:
+            _pending -= 1
+        raise
+    return await asyncio.wrap_future(future)
+
+
+async def hash_password(password: str) -> str:
+    return await _run("hash", pwd_context.hash, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str):
+    """Проверяет пароль. Возвращает (совпал ли, новый хэш или None).
+
+    Новый хэш приходит, если сохраненный посчитан с устаревшими параметрами -
+    его нужно записать пользователю.
+    """
+    return await _run("verify", pwd_context.verify_and_update, plain_password, hashed_password)
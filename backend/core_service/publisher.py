@@ -0,0 +1,236 @@
+import asyncio
+import collections
+import json
+import os
+import queue
+import threading
+
+import pika
+
+import metrics
+
+# Сколько постоянных каналов к RabbitMQ держит процесс (по одному соединению на канал:
+# BlockingConnection нельзя делить между потоками)
+PUBLISHER_POOL_SIZE = int(os.getenv("PUBLISHER_POOL_SIZE", "4"))
+# Сколько сообщений копим в памяти, пока брокер недоступен
+PUBLISHER_BUFFER_SIZE = int(os.getenv("PUBLISHER_BUFFER_SIZE", "1000"))
+# Как часто (в секундах) пытаемся дослать буфер и обслуживаем heartbeat простаивающих соединений
+PUBLISHER_RETRY_INTERVAL = float(os.getenv("PUBLISHER_RETRY_INTERVAL", "1"))
+# Сколько ждать свободный канал, прежде чем отложить сообщение в буфер
+PUBLISHER_CHECKOUT_TIMEOUT = float(os.getenv("PUBLISHER_CHECKOUT_TIMEOUT", "2"))
+
+
+class PublishBufferFull(Exception):
+    """Брокер недоступен, и буфер неотправленных сообщений заполнен."""
+
+
+class _PooledChannel:
+    """Одно постоянное соединение с каналом в режиме publisher confirms."""
+
+    def __init__(self, url: str):
+        self.connection = pika.BlockingConnection(pika.URLParameters(url))
+        self.channel = self.connection.channel()
+        # basic_publish теперь возвращается только после подтверждения брокера
+        # и бросает NackError/UnroutableError, если сообщение не принято
+        self.channel.confirm_delivery()
+        self.declared = set()
+
+    def declare(self, queue_name: str):
+        """Объявляет очередь (если ее еще нет) и возвращает число сообщений в ней."""
+        result = self.channel.queue_declare(queue=queue_name, durable=True)
+        self.declared.add(queue_name)
+        return result.method.message_count
+
+    def publish(self, queue_name: str, body: str):
+        if queue_name not in self.declared:
+            self.declare(queue_name)
+        self.channel.basic_publish(
+            exchange='',
+            routing_key=queue_name,
+            body=body,
+            properties=pika.BasicProperties(delivery_mode=2),
+            mandatory=True
+        )
+
+    def close(self):
+        try:
+            self.connection.close()
+        except Exception:
+            pass
+
+
+class Publisher:
+    """Общий для процесса публикатор сообщений в RabbitMQ.
+
+    Держит пул постоянных каналов с подтверждениями публикации, переподключается
+    при обрыве, а пока брокер недоступен - копит сообщения в ограниченном буфере
+    и досылает их из фонового потока. Запрос платит только за публикацию в уже
+    открытый канал, без AMQP-рукопожатия.
+    """
+
+    def __init__(self, url: str, pool_size: int = PUBLISHER_POOL_SIZE, buffer_size: int = PUBLISHER_BUFFER_SIZE,
+                 retry_interval: float = PUBLISHER_RETRY_INTERVAL, checkout_timeout: float = PUBLISHER_CHECKOUT_TIMEOUT):
+        self.url = url
+        self.buffer_size = buffer_size
+        self.retry_interval = retry_interval
+        self.checkout_timeout = checkout_timeout
+        # Слоты пула; None - соединение еще не открыто или было сброшено
+        self._idle = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._idle.put(None)
+        self._buffer = collections.deque()
+        self._buffer_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        # Очереди, глубину которых обновляет фоновый поток: имя -> число сообщений или None
+        self._depths = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._maintain, daemon=True)
+        self._thread.start()
+
+    def publish(self, queue_name: str, message: dict) -> bool:
+        """Публикует сообщение. Возвращает True, если брокер его подтвердил,
+        и False, если оно отложено в буфер до восстановления связи.
+
+        Бросает PublishBufferFull, если отложить сообщение уже некуда.
+        """
+        body = json.dumps(message)
+        # Пока буфер не пуст, брокер считаем недоступным: не ждем соединения
+        # в каждом запросе и не обгоняем уже отложенные сообщения
+        if not self._buffer:
+            try:
+                self._publish_now(queue_name, body)
+                return True
+            except (pika.exceptions.AMQPError, OSError, queue.Empty) as e:
+                print(f"Publisher: publish to {queue_name} failed ({e!r}), buffering", flush=True)
+        self._enqueue(queue_name, body)
+        return False
+
+    def watch_depth(self, *queue_names: str):
+        """Просит фоновый поток раз в retry_interval обновлять глубину очередей (см. depth())."""
+        for queue_name in queue_names:
+            self._depths.setdefault(queue_name, None)
+
+    def depth(self, queue_name: str):
+        """Последняя известная глубина очереди или None, если она еще неизвестна."""
+        return self._depths.get(queue_name)
+
+    async def publish_async(self, queue_name: str, message: dict) -> bool:
+        """То же, что publish(), но не блокирует event loop асинхронного эндпоинта."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.publish, queue_name, message)
+
+    def _publish_now(self, queue_name: str, body: str):
+        slot = self._idle.get(timeout=self.checkout_timeout)
+        try:
+            for attempt in range(2):
+                try:
+                    if slot is None:
+                        slot = _PooledChannel(self.url)
+                    slot.publish(queue_name, body)
+                    return
+                except (pika.exceptions.AMQPError, OSError):
+                    # Соединение могло тихо умереть, пока простаивало - пробуем один раз заново
+                    if slot is not None:
+                        slot.close()
+                        slot = None
+                    if attempt == 1:
+                        raise
+        finally:
+            self._idle.put(slot)
+
+    def _enqueue(self, queue_name: str, body: str):
+        with self._buffer_lock:
+            if len(self._buffer) >= self.buffer_size:
+                raise PublishBufferFull(f"{len(self._buffer)} messages are waiting for the broker")
+            self._buffer.append((queue_name, body))
+            metrics.set_gauge("publisher.buffered", len(self._buffer))
+
+    def _flush(self):
+        """Досылает отложенные сообщения по порядку, пока брокер их принимает."""
+        sent = 0
+        while True:
+            with self._buffer_lock:
+                if not self._buffer:
+                    break
+                queue_name, body = self._buffer[0]
+            try:
+                self._publish_now(queue_name, body)
+            except (pika.exceptions.AMQPError, OSError, queue.Empty):
+                break
+            with self._buffer_lock:
+                self._buffer.popleft()
+                metrics.set_gauge("publisher.buffered", len(self._buffer))
+            sent += 1
+        if sent:
+            print(f"Publisher: flushed {sent} buffered messages ({len(self._buffer)} left)", flush=True)
+
+    def _heartbeat(self):
+        """Обслуживает heartbeat простаивающих соединений, чтобы брокер их не закрыл."""
+        slots = []
+        try:
+            while True:
+                slots.append(self._idle.get_nowait())
+        except queue.Empty:
+            pass
+        for i, slot in enumerate(slots):
+            if slot is None:
+                continue
+            try:
+                slot.connection.process_data_events(time_limit=0)
+            except Exception:
+                slot.close()
+                slots[i] = None
+        for slot in slots:
+            self._idle.put(slot)
+
+    def _forget_depths(self):
+        for queue_name in self._depths:
+            self._depths[queue_name] = None
+
+    def _poll_depths(self):
+        if not self._depths:
+            return
+        # Пока брокер недоступен, устаревшая глубина хуже неизвестной
+        if self._buffer:
+            self._forget_depths()
+            return
+        slot = self._idle.get(timeout=self.checkout_timeout)
+        try:
+            if slot is None:
+                slot = _PooledChannel(self.url)
+            for queue_name in list(self._depths):
+                self._depths[queue_name] = slot.declare(queue_name)
+        except (pika.exceptions.AMQPError, OSError):
+            self._forget_depths()
+            if slot is not None:
+                slot.close()
+                slot = None
+            raise
+        finally:
+            self._idle.put(slot)
+
+    def _maintain(self):
+        while not self._stopped.wait(self.retry_interval):
+            try:
+                self._flush()
+                self._heartbeat()
+                self._poll_depths()
+            except Exception as e:
+                print(f"Publisher: maintenance failed: {e!r}", flush=True)
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._flush()
+        while True:
+            try:
+                slot = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            if slot is not None:
+                slot.close()
+        if self._buffer:
+            print(f"Publisher: {len(self._buffer)} buffered messages were not delivered", flush=True)
@@ -0,0 +1,81 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Сколько секунд помним уже пришедшие результаты - чтобы не потерять тот, что пришел
+# между чтением статуса из Mongo и подпиской на уведомление
+RECENT_RESULTS_TTL = float(os.getenv("RECENT_RESULTS_TTL", "60"))
+RECENT_RESULTS_SIZE = int(os.getenv("RECENT_RESULTS_SIZE", "10000"))
+
+
+class SubmissionNotifier:
+    """Внутрипроцессная рассылка результатов посылок.
+
+    Слушатель result_queue вызывает notify() сразу после записи результата в Mongo,
+    а эндпоинты (SSE и long-poll) ждут его через wait_async() вместо опроса базы.
+    Уведомления работают только внутри процесса: если результат забрал слушатель
+    другого процесса, ждущий узнает о нем, перечитав Mongo по таймауту.
+    """
+
+    def __init__(self, ttl: float = RECENT_RESULTS_TTL, max_entries: int = RECENT_RESULTS_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._recent = OrderedDict()  # submission_id -> (время, результат)
+        self._waiters = {}  # submission_id -> [(loop, future)]
+
+    def notify(self, submission_id: str, result: dict):
+        """Сообщает ждущим о результате посылки. Можно вызывать из любого потока."""
+        now = time.monotonic()
+        with self._lock:
+            self._recent[submission_id] = (now, result)
+            self._recent.move_to_end(submission_id)
+            while self._recent:
+                oldest_time, _ = next(iter(self._recent.values()))
+                if len(self._recent) <= self.max_entries and now - oldest_time < self.ttl:
+                    break
+                self._recent.popitem(last=False)
+            waiters = self._waiters.pop(submission_id, [])
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future, result)
+
+    async def wait_async(self, submission_id: str, timeout: float):
+        """Ждет результат посылки, не занимая поток. Возвращает его или None по таймауту."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            result = self._get_locked(submission_id)
+            if result is not None:
+                return result
+            self._waiters.setdefault(submission_id, []).append((loop, future))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._discard(submission_id, future)
+
+    def _get_locked(self, submission_id: str):
+        cached = self._recent.get(submission_id)
+        if cached is None or time.monotonic() - cached[0] >= self.ttl:
+            return None
+        return cached[1]
+
+    def _discard(self, submission_id: str, future):
+        with self._lock:
+            waiters = self._waiters.get(submission_id)
+            if not waiters:
+                return
+            waiters[:] = [item for item in waiters if item[1] is not future]
+            if not waiters:
+                del self._waiters[submission_id]
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+notifier = SubmissionNotifier()
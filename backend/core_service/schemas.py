@@ -79,4 +79,8 @@ class LessonInfoForAI(BaseModel):
     title: str
     course_id: int
     lesson_type: str
-    
\ No newline at end of file
+
+class TestSpec(BaseModel):
+    lesson_id: int
+    spec_version: str
+    test_code: str
@@ -1,15 +1,22 @@
+import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
+from sqlalchemy import event, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 import crud
+import metrics
 import models
 from config import SECRET_KEY, ALGORITHM
-from database import get_db
+from database import AsyncSessionLocal, get_db, get_async_db
 
 credentials_exception = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
@@ -19,6 +26,14 @@ credentials_exception = HTTPException(
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login/token")
 
+# Сколько секунд пользователь из токена живет в кэше и сколько пользователей держим
+# (изменения через ORM этого процесса сбрасывают запись сразу, TTL - для остальных)
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+_user_cache_lock = threading.Lock()
+_user_cache = OrderedDict()  # email -> (время загрузки, отсоединенный от сессии User)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -29,7 +44,33 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
+def _get_cached_user(email: str):
+    now = time.monotonic()
+    with _user_cache_lock:
+        cached = _user_cache.get(email)
+        if cached is None or now - cached[0] >= USER_CACHE_TTL:
+            return None
+        _user_cache.move_to_end(email)
+        return cached[1]
+
+def _cache_user(email: str, user: models.User):
+    with _user_cache_lock:
+        _user_cache[email] = (time.monotonic(), user)
+        _user_cache.move_to_end(email)
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+        metrics.set_gauge("auth.user_cache.size", len(_user_cache))
+
+def invalidate_user(email: Optional[str] = None):
+    """Сбрасывает пользователя (или весь кэш), например после изменения его данных."""
+    with _user_cache_lock:
+        if email is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(email, None)
+        metrics.set_gauge("auth.user_cache.size", len(_user_cache))
+
+def _get_subject(token: str) -> str:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -37,17 +78,81 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
+    return email
+
+def _lookup_cached_user(email: str):
+    # Подпись и срок действия токена уже проверены - таблицу users трогаем только при промахе
+    user = _get_cached_user(email)
+    metrics.inc("auth.user_cache.hits" if user is not None else "auth.user_cache.misses")
+    return user
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
+    email = _get_subject(token)
+    user = _lookup_cached_user(email)
+    if user is not None:
+        return user
+
     user = crud.get_user_by_email(db, email=email)
     
     if user is None:
         raise credentials_exception
+    # Отсоединяем от сессии запроса: объект переживет ее и будет общим для запросов
+    db.expunge(user)
+    _cache_user(email, user)
+    return user
+
+async def _load_user_async(db: AsyncSession, email: str) -> models.User:
+    user = await crud.get_user_by_email_async(db, email=email)
+
+    if user is None:
+        raise credentials_exception
+    db.expunge(user)
+    _cache_user(email, user)
     return user
 
+async def get_current_user_async(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> models.User:
+    """То же, что get_current_user, для асинхронных эндпоинтов."""
+    email = _get_subject(token)
+    user = _lookup_cached_user(email)
+    if user is not None:
+        return user
+    return await _load_user_async(db, email)
+
+async def get_current_user_detached(token: str = Depends(oauth2_scheme)) -> models.User:
+    """То же, что get_current_user_async, но сессия закрывается сразу после поиска пользователя.
+
+    Для эндпоинтов, которые долго ждут (long-poll, SSE): сессия из get_async_db закрылась бы
+    только после ответа и все это время держала бы соединение к Postgres.
+    """
+    email = _get_subject(token)
+    user = _lookup_cached_user(email)
+    if user is not None:
+        return user
+    async with AsyncSessionLocal() as db:
+        return await _load_user_async(db, email)
+
 def try_get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Optional[models.User]:
     try:
         # Пытаемся получить пользователя
         return get_current_user(token=token, db=db)
     except HTTPException:
         # Если получаем ошибку 401, просто возвращаем None
-        return None
\ No newline at end of file
+        return None
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, models.User):
+            # Прежний email тоже: пользователь мог его сменить
+            emails = session.info.setdefault("changed_user_emails", set())
+            emails.add(obj.email)
+            emails.update(inspect(obj).attrs.email.history.deleted)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    for email in session.info.pop("changed_user_emails", ()):
+        invalidate_user(email)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session):
+    session.info.pop("changed_user_emails", None)
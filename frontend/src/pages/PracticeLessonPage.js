@@ -22,33 +22,82 @@ function PracticeLessonPage() {
   const [output, setOutput] = useState('');
   const [isSubmitting, setIsSubmitting] = useState(false);
 
-  // useRef используется для хранения ID интервала, чтобы мы могли его остановить
-  const intervalRef = useRef(null);
+  // Контроллер текущего ожидания результата, чтобы его можно было прервать при уходе со страницы
+  const abortRef = useRef(null);
 
-  // Функция для проверки статуса выполнения кода на сервере
-  const checkStatus = async (submissionId) => {
+  // Показывает результат выполнения и разблокирует кнопку
+  const showResult = (output) => {
+    setOutput(output);
+    setIsSubmitting(false);
+  };
+
+  // Ждет результат через Server-Sent Events: сервер пришлет его, как только executor закончит.
+  // EventSource не умеет передавать заголовок Authorization, поэтому читаем поток через fetch.
+  const streamResult = async (submissionId, signal) => {
+    const token = localStorage.getItem('token');
+    const response = await fetch(`${apiClient.defaults.baseURL}/submissions/${submissionId}/events`, {
+      headers: token ? { Authorization: `Bearer ${token}` } : {},
+      signal,
+    });
+    if (!response.ok || !response.body) {
+      throw new Error(`SSE request failed: ${response.status}`);
+    }
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) {
+        return null;
+      }
+      buffer += decoder.decode(value, { stream: true });
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        const rawEvent = buffer.slice(0, boundary);
+        buffer = buffer.slice(boundary + 2);
+        const dataLine = rawEvent.split('\n').find((line) => line.startsWith('data: '));
+        if (dataLine) {
+          return JSON.parse(dataLine.slice('data: '.length));
+        }
+      }
+    }
+  };
+
+  // Запасной вариант: long-poll, сервер держит запрос до прихода результата
+  const pollResult = async (submissionId, signal) => {
+    for (;;) {
+      const response = await apiClient.get(`/submissions/${submissionId}`, {
+        params: { wait: 25 },
+        signal,
+      });
+      if (response.data.status !== 'pending') {
+        return response.data;
+      }
+    }
+  };
+
+  const waitForResult = async (submissionId) => {
+    const controller = new AbortController();
+    abortRef.current = controller;
     try {
-      const response = await apiClient.get(`/submissions/${submissionId}`);
-      const { status, output } = response.data;
-
-      if (status !== 'pending') {
-        // Если задача выполнена (успешно или с ошибкой),
-        // останавливаем интервал опроса
-        if (intervalRef.current) {
-          clearInterval(intervalRef.current);
+      let result = null;
+      try {
+        result = await streamResult(submissionId, controller.signal);
+      } catch (err) {
+        if (controller.signal.aborted) {
+          return;
         }
-        // Обновляем вывод и статус кнопки
-        setOutput(output);
-        setIsSubmitting(false);
+        console.error(err);
       }
+      if (!result || result.status === 'pending') {
+        result = await pollResult(submissionId, controller.signal);
+      }
+      showResult(result.output);
     } catch (err) {
-      // Если произошла ошибка при получении статуса, тоже останавливаем опрос
-      if (intervalRef.current) {
-        clearInterval(intervalRef.current);
+      if (!controller.signal.aborted) {
+        showResult('Ошибка при получении результата выполнения.');
+        console.error(err);
       }
-      setOutput('Ошибка при получении результата выполнения.');
-      setIsSubmitting(false);
-      console.error(err);
     }
   };
 
@@ -62,13 +111,18 @@ function PracticeLessonPage() {
       const response = await apiClient.post(`/lessons/${lessonId}/submit`, { code });
       const { submission_id } = response.data;
 
-      // Запускаем периодический опрос статуса задачи каждые 2 секунды
-      intervalRef.current = setInterval(() => {
-        checkStatus(submission_id);
-      }, 2000);
+      // Ждем результат: сервер сам сообщит, когда проверка закончится
+      await waitForResult(submission_id);
 
     } catch (err) {
-      setOutput('Ошибка отправки кода на сервер.');
+      const status = err.response?.status;
+      const retryAfter = err.response?.headers?.['retry-after'];
+      if (status === 429 || status === 503) {
+        // Сервер просит подождать: слишком частые посылки или перегружена проверка
+        setOutput(`Слишком много посылок, повторите через ${retryAfter || 'несколько'} сек.`);
+      } else {
+        setOutput('Ошибка отправки кода на сервер.');
+      }
       setIsSubmitting(false);
       console.error(err);
     }
@@ -94,8 +148,8 @@ function PracticeLessonPage() {
 
     // Функция очистки: будет вызвана, когда пользователь уходит со страницы
     return () => {
-      if (intervalRef.current) {
-        clearInterval(intervalRef.current);
+      if (abortRef.current) {
+        abortRef.current.abort();
       }
     };
   }, [lessonId]); // Эффект будет перезапущен, если ID урока в URL изменится